@@ -2,12 +2,16 @@ import os
 from dotenv import load_dotenv
 import openai
 import replicate
-from moviepy.editor import VideoFileClip, AudioFileClip, concatenate_videoclips
 import asyncio
 from pathlib import Path
 import json
-import requests
+import hashlib
+import diskcache
+import re
+import httpx
+import aiofiles
 import logging
+import subprocess
 from datetime import datetime
 
 # Configure logging
@@ -27,7 +31,6 @@ load_dotenv(override=True)
 api_key = os.getenv("OPENAI_API_KEY")
 if not api_key:
     raise ValueError("OPENAI_API_KEY not found in environment variables")
-openai.api_key = api_key
 
 # Configure Replicate
 replicate_token = os.getenv("REPLICATE_API_TOKEN")
@@ -38,6 +41,75 @@ os.environ["REPLICATE_API_TOKEN"] = replicate_token
 # Get the project root directory
 PROJECT_ROOT = Path(__file__).parent.absolute()
 
+# Connection pool settings for downloading generated frames
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+HTTP_TIMEOUT = 30.0
+
+# Connection pool settings for OpenAI API calls
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20)
+
+# Disk cache for OpenAI completions so identical requests are not paid for twice
+OPENAI_CACHE = diskcache.Cache(str(PROJECT_ROOT / ".cache" / "openai"))
+
+# FFmpeg binary, installed by setup.sh and overridable with the FFMPEG_BINARY env var
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+
+# How long each frame is shown in the final video, in seconds
+FRAME_DURATION = 3
+
+# Split narration after sentence-ending punctuation so each sentence can be voiced in parallel
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+def check_nvenc_available():
+    """Check whether NVENC encoding actually works on this host"""
+    # Listing h264_nvenc in `ffmpeg -encoders` only means it was compiled in, so
+    # encode a single test frame to confirm a usable NVIDIA GPU and driver are present
+    try:
+        result = subprocess.run(
+            [
+                FFMPEG_BINARY, "-hide_banner",
+                "-f", "lavfi", "-i", "color=s=256x256",
+                "-frames:v", "1",
+                "-c:v", "h264_nvenc",
+                "-f", "null", "-"
+            ],
+            capture_output=True,
+            text=True,
+            timeout=10
+        )
+        return result.returncode == 0
+    except (OSError, subprocess.SubprocessError) as e:
+        logging.debug(f"Could not probe FFmpeg encoders: {str(e)}")
+        return False
+
+# Use the GPU hardware encoder when available, otherwise fall back to x264
+NVENC_AVAILABLE = check_nvenc_available()
+logging.info(f"NVENC hardware encoding {'enabled' if NVENC_AVAILABLE else 'not available, using libx264'}")
+
+def create_openai_client():
+    """Create an async OpenAI client that shares one HTTP/2 connection pool across calls"""
+    return openai.AsyncOpenAI(
+        api_key=api_key,
+        http_client=httpx.AsyncClient(http2=True, limits=OPENAI_HTTP_LIMITS)
+    )
+
+def completion_cache_key(model, system_message, prompt):
+    """Build a content-addressed cache key for a chat completion request"""
+    payload = json.dumps([model, system_message, prompt])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+async def gather_or_cancel(*aws):
+    """Run awaitables concurrently, cancelling the rest as soon as one fails"""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        # Plain gather leaves siblings running, so cancel them and wait for them to finish
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 def create_output_directory(topic):
     """Create a timestamped directory for the video project"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
@@ -47,7 +119,7 @@ def create_output_directory(topic):
     logging.info(f"Created output directory: {project_dir}")
     return project_dir
 
-def generate_script(topic):
+async def generate_script(client, topic):
     """Generate a script using GPT-4"""
     logging.debug(f"Generating script for topic: {topic}")
     prompt = f"""Create a short, engaging script about {topic}. The script should be:
@@ -60,17 +132,49 @@ def generate_script(topic):
     - "script": The narration text
     - "scenes": List of scene descriptions for image generation
     """
+    # JSON mode requires a GPT-4 Turbo (or newer) model
+    model = "gpt-4-turbo"
+    system_message = "You are a creative scriptwriter."
+    cache_key = completion_cache_key(model, system_message, prompt)
     
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a creative scriptwriter."},
-                {"role": "user", "content": prompt}
-            ]
-        )
+        raw_content = OPENAI_CACHE.get(cache_key)
+        cached = raw_content is not None
+        if not cached:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=[
+                    {"role": "system", "content": system_message},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"},
+                stream=True
+            )
+            
+            chunks = []
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+            raw_content = "".join(chunks)
+        else:
+            logging.debug(f"Using cached script for topic: {topic}")
         
-        content = json.loads(response.choices[0].message.content)
+        content = json.loads(raw_content)
+        if not (
+            isinstance(content, dict)
+            and isinstance(content.get("script"), str)
+            and content["script"].strip()
+            and isinstance(content.get("scenes"), list)
+            and content["scenes"]
+            and all(isinstance(scene, str) and scene.strip() for scene in content["scenes"])
+        ):
+            # Drop any stale entry so a bad reply is regenerated next run
+            OPENAI_CACHE.delete(cache_key)
+            raise ValueError("Script response must contain a non-empty 'script' string and a non-empty 'scenes' list of strings")
+        
+        # Only cache well-formed scripts, and only when they came from the API
+        if not cached:
+            OPENAI_CACHE.set(cache_key, raw_content)
         logging.debug(f"Generated script: {content['script'][:100]}...")
         logging.debug(f"Generated {len(content['scenes'])} scenes")
         return content
@@ -78,94 +182,176 @@ def generate_script(topic):
         logging.error(f"Error generating script: {str(e)}")
         raise
 
-def generate_audio(script, output_dir):
+async def generate_audio_segment(client, i, sentence, output_path):
+    """Generate audio for a single sentence using OpenAI TTS"""
+    try:
+        response = await client.audio.speech.create(
+            model="tts-1",
+            voice="alloy",
+            input=sentence
+        )
+        
+        async with aiofiles.open(output_path, "wb") as f:
+            await f.write(response.content)
+        return output_path
+    except Exception as e:
+        logging.error(f"Error generating audio segment {i+1}: {str(e)}")
+        raise
+
+async def generate_audio(client, script, output_dir):
     """Generate audio from script using OpenAI TTS"""
     output_path = output_dir / "narration.mp3"
+    segments_dir = output_dir / "audio"
+    segments_dir.mkdir(exist_ok=True)
     logging.debug(f"Generating audio for script: {script[:100]}...")
     
     try:
-        response = openai.audio.speech.create(
-            model="tts-1",
-            voice="alloy",
-            input=script
-        )
+        # Voice each sentence concurrently, then join the segments in order
+        sentences = [sentence for sentence in SENTENCE_BOUNDARY.split(script.strip()) if sentence]
+        if not sentences:
+            raise ValueError("Script is empty, there is no narration to generate audio for")
+        logging.debug(f"Generating {len(sentences)} audio segments")
+        
+        segments = await gather_or_cancel(*[
+            generate_audio_segment(client, i, sentence, segments_dir / f"segment_{i}.mp3")
+            for i, sentence in enumerate(sentences)
+        ])
+        
+        concat_path = segments_dir / "concat.txt"
+        write_concat_file(segments, concat_path)
+        await asyncio.to_thread(run_ffmpeg, [
+            "-f", "concat", "-safe", "0", "-i", concat_path,
+            "-c", "copy",
+            output_path
+        ])
         
-        response.stream_to_file(str(output_path))
         logging.debug(f"Audio generated successfully: {output_path}")
         return output_path
     except Exception as e:
         logging.error(f"Error generating audio: {str(e)}")
         raise
 
-def generate_video_frames(scenes, output_dir):
+async def generate_frame(i, scene, total):
+    """Generate a single video frame using Stable Diffusion and return its image URL"""
+    logging.debug(f"Generating frame {i+1}/{total}: {scene[:50]}...")
+    
+    try:
+        # Run Stable Diffusion model
+        output = await replicate.async_run(
+            "stability-ai/stable-diffusion:db21e45d3f7023abc2a46ee38a23973f6dce16bb082a930b0c49861f96d1e5bf",
+            input={
+                "prompt": scene,
+                "negative_prompt": "blurry, low quality, distorted",
+                "num_outputs": 1,
+                "guidance_scale": 7.5,
+                "num_inference_steps": 50,
+                "scheduler": "K_EULER",
+                "width": 1024,
+                "height": 576
+            }
+        )
+        return str(output[0])
+    except Exception as e:
+        logging.error(f"Error generating frame {i+1}: {str(e)}")
+        raise
+
+async def download_frame(client, i, url, output_path):
+    """Download a generated image to disk"""
+    try:
+        async with client.stream("GET", url) as response:
+            response.raise_for_status()
+            async with aiofiles.open(output_path, "wb") as f:
+                async for chunk in response.aiter_bytes():
+                    await f.write(chunk)
+        
+        logging.debug(f"Frame {i+1} generated successfully")
+        return output_path
+    except Exception as e:
+        logging.error(f"Error downloading frame {i+1}: {str(e)}")
+        raise
+
+async def generate_video_frames(scenes, output_dir):
     """Generate video frames using Stable Diffusion"""
-    frames = []
     frames_dir = output_dir / "frames"
     frames_dir.mkdir(exist_ok=True)
     
     logging.debug(f"Generating {len(scenes)} video frames")
     
-    for i, scene in enumerate(scenes):
-        output_path = frames_dir / f"frame_{i}.png"
-        logging.debug(f"Generating frame {i+1}/{len(scenes)}: {scene[:50]}...")
-        
-        try:
-            # Run Stable Diffusion model
-            output = replicate.run(
-                "stability-ai/stable-diffusion:db21e45d3f7023abc2a46ee38a23973f6dce16bb082a930b0c49861f96d1e5bf",
-                input={
-                    "prompt": scene,
-                    "negative_prompt": "blurry, low quality, distorted",
-                    "num_outputs": 1,
-                    "guidance_scale": 7.5,
-                    "num_inference_steps": 50,
-                    "scheduler": "K_EULER",
-                    "width": 1024,
-                    "height": 576
-                }
-            )
-            
-            # Download the generated image
-            response = requests.get(output[0])
-            with open(output_path, "wb") as f:
-                f.write(response.content)
-            
-            frames.append(output_path)
-            logging.debug(f"Frame {i+1} generated successfully")
-        except Exception as e:
-            logging.error(f"Error generating frame {i+1}: {str(e)}")
-            raise
+    # Each scene is an independent Replicate prediction, so run them concurrently
+    output_paths = [frames_dir / f"frame_{i}.png" for i in range(len(scenes))]
+    urls = await gather_or_cancel(*[
+        generate_frame(i, scene, len(scenes))
+        for i, scene in enumerate(scenes)
+    ])
+    
+    # Download the generated images over a single keep-alive connection pool
+    async with httpx.AsyncClient(limits=HTTP_LIMITS, http2=True, timeout=HTTP_TIMEOUT) as client:
+        frames = await gather_or_cancel(*[
+            download_frame(client, i, url, output_paths[i])
+            for i, url in enumerate(urls)
+        ])
+    
+    return list(frames)
+
+def run_ffmpeg(args):
+    """Run FFmpeg with the given arguments, logging its output on failure"""
+    command = [FFMPEG_BINARY, "-hide_banner", "-y", *[str(arg) for arg in args]]
+    logging.debug(f"Running FFmpeg: {' '.join(command)}")
     
-    return frames
+    try:
+        subprocess.run(command, capture_output=True, text=True, check=True)
+    except subprocess.CalledProcessError as e:
+        logging.error(f"FFmpeg failed: {e.stderr}")
+        raise
+
+def concat_file_entry(path):
+    """Format a concat demuxer file directive, escaping single quotes in the path"""
+    quoted = Path(path).absolute().as_posix().replace("'", "'\\''")
+    return f"file '{quoted}'"
+
+def write_concat_file(paths, concat_path, duration=None):
+    """Write an FFmpeg concat demuxer playlist, optionally showing each entry for a fixed duration"""
+    lines = []
+    for path in paths:
+        lines.append(concat_file_entry(path))
+        if duration is not None:
+            lines.append(f"duration {duration}")
+    
+    # The concat demuxer ignores the duration of the last entry unless the file is repeated
+    if duration is not None and paths:
+        lines.append(concat_file_entry(paths[-1]))
+    
+    with open(concat_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
 
 def create_video(frames, audio_path, output_path):
     """Create final video by combining frames and audio"""
     logging.debug(f"Creating final video with {len(frames)} frames")
     
     try:
-        # Create video from frames
-        clips = []
-        for frame_path in frames:
-            clip = VideoFileClip(str(frame_path)).set_duration(3)  # Each frame shows for 3 seconds
-            clips.append(clip)
+        # Build a playlist of the frames so a single FFmpeg process can encode them
+        concat_path = Path(output_path).parent / "concat.txt"
+        write_concat_file(frames, concat_path, duration=FRAME_DURATION)
         
-        video = concatenate_videoclips(clips)
+        if NVENC_AVAILABLE:
+            video_args = ["-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", "-cq", "23"]
+        else:
+            video_args = ["-c:v", "libx264"]
         
-        # Add audio
-        audio = AudioFileClip(str(audio_path))
-        final_video = video.set_audio(audio)
-        
-        # Write final video
-        final_video.write_videofile(
-            str(output_path),
-            fps=24,
-            codec='libx264',
-            audio_codec='aac'
-        )
-        
-        # Clean up
-        video.close()
-        audio.close()
+        # Scale, retime, encode and mux in a single filter graph so no frames pass through Python
+        run_ffmpeg([
+            "-f", "concat", "-safe", "0", "-i", concat_path,
+            "-i", audio_path,
+            "-filter_complex", "[0:v]fps=24,scale=1024:576,format=yuv420p[v]",
+            "-map", "[v]",
+            "-map", "1:a",
+            *video_args,
+            "-c:a", "aac",
+            "-b:a", "192k",
+            "-movflags", "+faststart",
+            "-shortest",
+            output_path
+        ])
         
         logging.debug(f"Final video created successfully: {output_path}")
     except Exception as e:
@@ -193,23 +379,24 @@ async def generate_video(topic):
     # Create output directory
     output_dir = create_output_directory(topic)
     
+    # Share one pooled OpenAI client across every API call in this run
+    client = create_openai_client()
+    
     try:
         # Generate script
         logging.info("Generating script...")
-        content = generate_script(topic)
+        content = await generate_script(client, topic)
         script = content["script"]
         scenes = content["scenes"]
         
         # Save project info
         save_project_info(output_dir, topic, script, scenes)
         
-        # Generate audio
-        logging.info("Generating audio...")
-        audio_path = generate_audio(script, output_dir)
-        
-        # Generate video frames
-        logging.info("Generating video frames...")
-        frames = generate_video_frames(scenes, output_dir)
+        # Generate audio and video frames concurrently, both only depend on the script
+        logging.info("Generating audio and video frames...")
+        audio_task = asyncio.create_task(generate_audio(client, script, output_dir))
+        frames_task = asyncio.create_task(generate_video_frames(scenes, output_dir))
+        audio_path, frames = await gather_or_cancel(audio_task, frames_task)
         
         # Create final video
         logging.info("Creating final video...")
@@ -221,6 +408,8 @@ async def generate_video(topic):
     except Exception as e:
         logging.error(f"Error in video generation: {str(e)}")
         raise
+    finally:
+        await client.close()
 
 def test_video_generation():
     """Test function to verify video generation with a short topic"""